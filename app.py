@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import os
 
+from clockify_core import load_data, apply_filters, highlight_all
+
 # -----------------------------------------------------------------------------
 # CONFIGURACIÓN (AQUÍ EDITAS LAS HORAS)
 # -----------------------------------------------------------------------------
@@ -31,59 +34,132 @@ st.set_page_config(page_title="Dashboard Clockify", page_icon="📊", layout="wi
 # FUNCIONES
 # -----------------------------------------------------------------------------
 
-@st.cache_data
-def load_data(file_path_or_buffer):
-    try:
-        # Detectar si es ruta local o archivo subido
-        if isinstance(file_path_or_buffer, str):
-            file_source = file_path_or_buffer
-            filename = file_path_or_buffer
-        else:
-            file_source = file_path_or_buffer
-            filename = file_path_or_buffer.name
-
-        # Cargar según extensión
-        if filename.endswith('.csv'):
-            df = pd.read_csv(file_source, parse_dates=['Start Date'], dayfirst=True)
-        else:
-            df = pd.read_excel(file_source)
-        return df
-    except Exception as e:
-        st.error(f"Error al leer datos: {e}")
-        return None
-
-def process_data(df):
-    if 'Project' not in df.columns:
-        return df
-    
-    # Limpieza
-    df = df.dropna(subset=['Project'])
-    if 'Duration (decimal)' in df.columns:
-        df['Duration (decimal)'] = pd.to_numeric(df['Duration (decimal)'], errors='coerce').fillna(0)
-    
-    # Crear columna Mes
-    if 'Start Date' in df.columns:
-        df['Month_Year'] = df['Start Date'].dt.to_period('M').astype(str)
-        
-    return df
-
-def highlight_row(row):
-    """Pinta la fila de rojo si se excede el presupuesto"""
-    try:
-        if row['Horas Restantes'] < 0:
-            return ['background-color: #ffcccc; color: black'] * len(row)
-    except:
-        pass
-    return [''] * len(row)
+@st.cache_data(show_spinner=False)
+def build_budget_template(projects):
+    """Presupuesto inicial por proyecto. Solo se reconstruye si cambia la lista de proyectos."""
+    # Si el proyecto está en tu lista manual, usa ese valor. Si no, usa el default.
+    projects_idx = pd.Index(projects, name='Project')
+    horas = (
+        projects_idx.to_series()
+        .map(PRESUPUESTOS_CONFIG)
+        .fillna(DEFAULT_BUDGET)
+        .to_numpy(dtype=np.float32)
+    )
+    return pd.DataFrame({'Project': projects_idx.to_numpy(), 'Horas Contratadas': horas})
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def build_bar_chart(chart_key, _merged):
+    """Gráfico presupuesto vs consumo. Se cachea por contenido: con los mismos datos no se reconstruye"""
+    # (caché compartida por todas las sesiones: se limita a las últimas selecciones)
+    return px.bar(
+        _merged, x='Project', y=['Horas Contratadas', 'Horas Consumidas'], barmode='group',
+        color_discrete_map={'Horas Contratadas': '#BDC3C7', 'Horas Consumidas': '#E74C3C'}
+    )
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def render_table_html(table_key, _merged, format_dict):
+    """Tabla de detalle ya formateada y coloreada como HTML; con los mismos datos se reutiliza"""
+    # Los nombres vienen del archivo subido: se escapan todas las celdas (incluida 'Project').
+    # Va en la misma llamada que los formatos: un segundo .format() reinicia las columnas que no nombra
+    return (
+        _merged.style
+        .format(format_dict, escape="html")
+        .apply(highlight_all, axis=None)
+        .hide(axis='index')
+        .to_html()
+    )
 
 # -----------------------------------------------------------------------------
 # MAIN APP
 # -----------------------------------------------------------------------------
 
+@st.fragment
+def filter_and_render(df, options, edited_budget_df):
+    """Filtros, gráfico y tabla. Los cambios de filtro re-ejecutan solo este fragmento, no la carga ni los presupuestos."""
+    # --- FILTROS DE VISUALIZACIÓN ---
+    # (en el cuerpo de la página: un fragmento no puede escribir en la barra lateral)
+    st.subheader("🔎 Filtros de Visualización")
+    col_f1, col_f2, col_f3 = st.columns(3)
+
+    with col_f1:
+        # 1. Filtro Proyecto
+        unique_projects = options['projects']
+        sel_projects = st.multiselect(
+            "Filtrar Proyectos",
+            unique_projects,
+            default=unique_projects
+        )
+
+    with col_f2:
+        # 2. Filtro Usuarios
+        all_users = options['users']
+        sel_users = st.multiselect(
+            "Filtrar Usuarios",
+            all_users,
+            default=all_users
+        )
+
+    with col_f3:
+        # 3. Filtro Meses
+        all_months = options['months']
+        sel_months = st.multiselect(
+            "Filtrar Meses",
+            all_months,
+            default=all_months
+        )
+
+    # APLICAR FILTROS
+    df_filtered = apply_filters(df, options, sel_projects, sel_users, sel_months)
+
+    if df_filtered.empty:
+        st.warning("No hay datos con los filtros seleccionados.")
+        return
+
+    # --- CÁLCULOS ---
+    grouped = df_filtered.groupby('Project', observed=True, sort=False, as_index=False)['Duration (decimal)'].sum()
+    grouped.rename(columns={'Duration (decimal)': 'Horas Consumidas'}, inplace=True)
+    
+    # Unir presupuesto (edited_budget_df) con lo consumido (grouped) alineando por proyecto
+    contratadas = edited_budget_df['Horas Contratadas'].to_numpy(dtype=np.float32, na_value=0.0)
+    consumidas = grouped.set_index('Project')['Horas Consumidas'].reindex(
+        edited_budget_df['Project'].to_numpy(), fill_value=0.0
+    ).to_numpy()
+    merged = edited_budget_df.assign(**{
+        'Horas Contratadas': contratadas,
+        'Horas Consumidas': consumidas,
+        'Horas Restantes': contratadas - consumidas
+    })
+    
+    # IMPORTANTE: Filtramos también el dataframe 'merged' para que en la tabla
+    # solo salgan los proyectos que has seleccionado en el filtro
+    merged = merged[merged['Project'].isin(sel_projects)]
+
+    # Huella del contenido de 'merged': clave de caché del gráfico y de la tabla
+    merged_key = hash((
+        tuple(merged['Project']),
+        merged['Horas Contratadas'].to_numpy().tobytes(),
+        merged['Horas Consumidas'].to_numpy().tobytes()
+    ))
+
+    # --- GRÁFICOS ---
+    st.subheader("Comparativa de Proyectos")
+    fig = build_bar_chart(merged_key, merged)
+    st.plotly_chart(fig, use_container_width=True)
+
+    # --- TABLA DETALLE ---
+    st.subheader("📋 Detalle Financiero")
+    format_dict = {
+        'Horas Contratadas': '{:,.0f}',
+        'Horas Consumidas': '{:,.2f}', 
+        'Horas Restantes': '{:,.2f}'
+    }
+
+    st.markdown(render_table_html(merged_key, merged, format_dict), unsafe_allow_html=True)
+
 def main():
     st.title("📊 Dashboard de Control de Horas")
 
-    df_raw = None
+    df, options = None, None
     
     # --- BARRA LATERAL ---
     with st.sidebar:
@@ -93,33 +169,25 @@ def main():
         uploaded_file = st.file_uploader("Subir archivo (Opcional)", type=["csv", "xlsx"])
         
         if uploaded_file:
-            df_raw = load_data(uploaded_file)
+            df, options = load_data(uploaded_file)
             st.success("✅ Archivo manual cargado")
         elif os.path.exists(ARCHIVO_DEFECTO):
-            df_raw = load_data(ARCHIVO_DEFECTO)
+            df, options = load_data(ARCHIVO_DEFECTO)
             st.info(f"📂 Datos del repositorio cargados")
         else:
             st.warning("⚠️ No se encuentran datos.")
 
     # Si hay datos, mostramos el resto
-    if df_raw is not None:
-        df = process_data(df_raw)
-
+    if df is not None:
         # --- GESTIÓN DE PRESUPUESTOS ---
         st.sidebar.divider()
         st.sidebar.header("2. Presupuestos")
         
         # Obtenemos proyectos únicos del archivo
-        unique_projects = sorted(df['Project'].astype(str).unique())
+        unique_projects = options['projects']
         
         # Cruzamos con tu configuración manual (PRESUPUESTOS_CONFIG)
-        budget_data = []
-        for proj in unique_projects:
-            # Si el proyecto está en tu lista manual, usa ese valor. Si no, usa el default.
-            horas = PRESUPUESTOS_CONFIG.get(proj, DEFAULT_BUDGET)
-            budget_data.append({'Project': proj, 'Horas Contratadas': float(horas)})
-            
-        budget_template = pd.DataFrame(budget_data)
+        budget_template = build_budget_template(tuple(unique_projects))
 
         # Editor visual (por si quieren ajustar algo puntualmente)
         edited_budget_df = st.data_editor(
@@ -132,80 +200,8 @@ def main():
             key="budget_editor"
         )
 
-        # --- FILTROS DE VISUALIZACIÓN (RECUPERADOS) ---
-        st.sidebar.divider()
-        st.sidebar.header("3. Filtros de Visualización")
-        
-        # 1. Filtro Proyecto (¡Recuperado!)
-        sel_projects = st.sidebar.multiselect(
-            "Filtrar Proyectos",
-            unique_projects,
-            default=unique_projects
-        )
-
-        # 2. Filtro Usuarios
-        all_users = sorted(df['User'].unique())
-        sel_users = st.sidebar.multiselect(
-            "Filtrar Usuarios",
-            all_users,
-            default=all_users
-        )
-
-        # 3. Filtro Meses
-        all_months = sorted(df['Month_Year'].unique())
-        sel_months = st.sidebar.multiselect(
-            "Filtrar Meses",
-            all_months,
-            default=all_months
-        )
-
-        # APLICAR FILTROS
-        df_filtered = df[
-            (df['Project'].isin(sel_projects)) &
-            (df['User'].isin(sel_users)) &
-            (df['Month_Year'].isin(sel_months))
-        ]
-
-        if df_filtered.empty:
-            st.warning("No hay datos con los filtros seleccionados.")
-            return
-
-        # --- CÁLCULOS ---
-        grouped = df_filtered.groupby('Project')['Duration (decimal)'].sum().reset_index()
-        grouped.rename(columns={'Duration (decimal)': 'Horas Consumidas'}, inplace=True)
-        
-        # Unir presupuesto (edited_budget_df) con lo consumido (grouped)
-        merged = pd.merge(edited_budget_df, grouped, on='Project', how='left').fillna(0)
-        
-        # IMPORTANTE: Filtramos también el dataframe 'merged' para que en la tabla
-        # solo salgan los proyectos que has seleccionado en el filtro
-        merged = merged[merged['Project'].isin(sel_projects)]
-
-        merged['Horas Restantes'] = merged['Horas Contratadas'] - merged['Horas Consumidas']
-
-        # --- GRÁFICOS ---
-        st.subheader("Comparativa de Proyectos")
-        fig = px.bar(
-            merged.melt(id_vars='Project', value_vars=['Horas Contratadas', 'Horas Consumidas']),
-            x='Project', y='value', color='variable', barmode='group',
-            color_discrete_map={'Horas Contratadas': '#BDC3C7', 'Horas Consumidas': '#E74C3C'}
-        )
-        st.plotly_chart(fig, use_container_width=True)
-
-        # --- TABLA DETALLE ---
-        st.subheader("📋 Detalle Financiero")
-        format_dict = {
-            'Horas Contratadas': '{:,.0f}',
-            'Horas Consumidas': '{:,.2f}', 
-            'Horas Restantes': '{:,.2f}'
-        }
-        
-        st.dataframe(
-            merged.style
-            .format(format_dict)
-            .apply(highlight_row, axis=1), 
-            use_container_width=True
-        )
+        # Filtros, gráficos y tabla: al tocar un filtro solo se re-ejecuta este bloque
+        filter_and_render(df, options, edited_budget_df)
 
 if __name__ == "__main__":
     main()
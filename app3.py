@@ -2,7 +2,11 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
 import io
+import zipfile
+
+from clockify_core import load_data, apply_filters, format_months, highlight_all, HAS_PYARROW
 
 # -----------------------------------------------------------------------------
 # CONFIGURACIÓN DE LA PÁGINA
@@ -14,55 +18,83 @@ st.set_page_config(
 )
 
 # -----------------------------------------------------------------------------
-# FUNCIONES DE CARGA Y PROCESAMIENTO
+# FUNCIONES DE EXPORTACIÓN
 # -----------------------------------------------------------------------------
 
-@st.cache_data
-def load_data(file):
+def build_report_zip(display_df, pivot_view, df_filtered):
     """
-    Carga el archivo CSV o Excel subido por el usuario.
-    Maneja errores de formato y detecta la extensión.
+    Genera el ZIP de descarga: un Excel con el resumen y el detalle por usuario, y los
+    datos filtrados en CSV (escribir miles de filas celda a celda en Excel es muy lento).
+    Solo se llama cuando el usuario lo pide.
     """
-    try:
-        if file.name.endswith('.csv'):
-            # Clockify a veces usa coma o punto y coma dependiendo de la config regional
-            df = pd.read_csv(file, parse_dates=['Start Date'], dayfirst=True)
-        else:
-            df = pd.read_excel(file)
-        return df
-    except Exception as e:
-        st.error(f"Error al leer el archivo: {e}")
-        return None
+    # Los cálculos van en float32; en el archivo se pasan a float64 redondeado a 2 decimales
+    # para que Excel no muestre restos de la conversión (21.880001 en vez de 21.88)
+    num_cols = display_df.select_dtypes('number').columns
+    display_df = display_df.astype({c: 'float64' for c in num_cols}).round(2)
+    pivot_view = pivot_view.astype('float64').round(2)
 
-def validate_columns(df):
-    """
-    Verifica que las columnas esenciales de Clockify existan.
-    Se adapta a nombres comunes ('Project', 'User', 'Duration (decimal)').
-    """
-    # Ajusta estos nombres si tu export de Clockify tiene headers diferentes
-    required_columns = ['Project', 'User', 'Duration (decimal)', 'Start Date']
-    
-    missing = [col for col in required_columns if col not in df.columns]
-    
-    if missing:
-        st.error(f"⚠️ El archivo no tiene las columnas requeridas: {missing}. Por favor verifica tu exportación.")
-        return False
-    return True
+    excel_buffer = io.BytesIO()
+    # xlsxwriter escribe bastante más rápido que openpyxl. Sin 'constant_memory': pandas escribe
+    # por columnas y ese modo descarta las celdas de filas ya volcadas
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        display_df.to_excel(writer, sheet_name='Resumen Proyectos')
+        pivot_view.to_excel(writer, sheet_name='Detalle Usuarios')
 
-def process_data(df):
-    """
-    Limpieza y pre-procesamiento de datos.
-    """
-    # Eliminar filas donde no haya proyecto asignado (si aplica)
-    df = df.dropna(subset=['Project'])
-    
-    # Asegurar que la duración es numérica
-    df['Duration (decimal)'] = pd.to_numeric(df['Duration (decimal)'], errors='coerce').fillna(0)
-    
-    # Extraer Mes y Año para filtros
-    df['Month_Year'] = df['Start Date'].dt.to_period('M').astype(str)
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('reporte_control_costes.xlsx', excel_buffer.getvalue())
+        # utf-8-sig para que Excel abra bien los acentos
+        z.writestr('data_cruda_filtrada.csv', format_months(df_filtered).to_csv(index=False).encode('utf-8-sig'))
+    return zip_buffer.getvalue()
+
+def build_raw_parquet(df_filtered):
+    """Datos filtrados en Parquet: columnar y comprimido, mucho más pequeño y rápido de escribir que CSV o Excel"""
+    # Duración en float64 redondeada: quien lea el archivo obtiene 0.72 y no 0.7200000286
+    df_filtered = df_filtered.assign(**{
+        'Duration (decimal)': df_filtered['Duration (decimal)'].astype('float64').round(2)
+    })
+    buffer = io.BytesIO()
+    df_filtered.to_parquet(buffer, engine='pyarrow', compression='zstd', index=False)
+    return buffer.getvalue()
+
+# -----------------------------------------------------------------------------
+# FUNCIONES DE GRÁFICOS
+# Se cachean por contenido: con los mismos datos no se vuelve a construir la figura.
+# La caché es del proceso (compartida por todas las sesiones): se limita a las últimas selecciones
+# -----------------------------------------------------------------------------
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def build_bar_chart(chart_key, _merged_df):
+    """Gráfico de barras agrupadas presupuesto vs consumo por proyecto"""
+    # Transformamos datos para Plotly (Melting)
+    chart_data = _merged_df.melt(
+        id_vars=['Project'], 
+        value_vars=['Horas Contratadas', 'Horas Consumidas'],
+        var_name='Tipo', 
+        value_name='Horas'
+    )
     
-    return df
+    return px.bar(
+        chart_data, 
+        x='Project', 
+        y='Horas', 
+        color='Tipo', 
+        barmode='group',
+        title="Horas Contratadas vs Consumidas por Proyecto",
+        color_discrete_map={'Horas Contratadas': '#2E86C1', 'Horas Consumidas': '#E74C3C'},
+        text_auto='.1f'
+    )
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def build_pie_chart(chart_key, _user_dist):
+    """Pie chart de distribución de trabajo por usuario"""
+    return px.pie(
+        _user_dist, 
+        values='Duration (decimal)', 
+        names='User', 
+        title="Carga de Trabajo (Horas)",
+        hole=0.4
+    )
 
 # -----------------------------------------------------------------------------
 # INTERFAZ PRINCIPAL
@@ -80,28 +112,29 @@ def main():
         st.info("💡 Asegúrate de exportar el reporte 'Detailed' de Clockify con duración decimal.")
 
     if uploaded_file is not None:
-        # Cargar datos
-        df_raw = load_data(uploaded_file)
-
-        if df_raw is not None and validate_columns(df_raw):
-            df = process_data(df_raw)
+        # Cargar datos (ya validados y procesados)
+        df, options = load_data(uploaded_file)
 
+        if df is not None:
             # 2. INPUT DE PRESUPUESTOS (Dinámico)
             st.sidebar.header("2. Presupuestos")
             st.sidebar.markdown("Define las horas contratadas por proyecto:")
             
             # Obtenemos lista única de proyectos
-            unique_projects = sorted(df['Project'].unique())
+            unique_projects = options['projects']
             
-            # Creamos un DF temporal para que el usuario edite
-            budget_template = pd.DataFrame({
-                'Project': unique_projects,
-                'Horas Contratadas': [100.0] * len(unique_projects) # Valor por defecto
-            })
+            # Creamos un DF temporal para que el usuario edite. Se guarda en la sesión y solo se
+            # reconstruye si cambia la lista de proyectos (p. ej. al subir otro archivo)
+            if 'budgets' not in st.session_state or list(st.session_state['budgets']['Project']) != unique_projects:
+                st.session_state['budgets'] = pd.DataFrame({
+                    'Project': unique_projects,
+                    'Horas Contratadas': np.full(len(unique_projects), 100.0, dtype=np.float32) # Valor por defecto
+                })
 
             # Data Editor permite editar celdas como un Excel dentro de la web
+            # (la key depende de los proyectos: con otro archivo no se heredan ediciones por posición)
             edited_budget_df = st.data_editor(
-                budget_template,
+                st.session_state['budgets'],
                 column_config={
                     "Horas Contratadas": st.column_config.NumberColumn(
                         "Horas Contratadas",
@@ -112,7 +145,8 @@ def main():
                     )
                 },
                 hide_index=True,
-                use_container_width=True
+                use_container_width=True,
+                key=f"budget_editor_{hash(tuple(unique_projects))}"
             )
 
             # 3. FILTROS EN PANTALLA
@@ -121,24 +155,20 @@ def main():
             
             with col_f1:
                 # Filtro de Meses
-                all_months = sorted(df['Month_Year'].unique())
+                all_months = options['months']
                 selected_months = st.multiselect("Filtrar por Mes:", all_months, default=all_months)
             
             with col_f2:
                 # Filtro de Usuarios
-                all_users = sorted(df['User'].unique())
+                all_users = options['users']
                 selected_users = st.multiselect("Filtrar por Usuario:", all_users, default=all_users)
             
             with col_f3:
                  # Filtro de Proyectos (para visualizar detalle)
                 selected_projects_filter = st.multiselect("Filtrar por Proyecto (Visualización):", unique_projects, default=unique_projects)
 
-            # Aplicar filtros al DataFrame principal
-            df_filtered = df[
-                (df['Month_Year'].isin(selected_months)) & 
-                (df['User'].isin(selected_users)) &
-                (df['Project'].isin(selected_projects_filter))
-            ]
+            # Aplicar filtros al DataFrame principal (una sola máscara sobre códigos enteros)
+            df_filtered = apply_filters(df, options, selected_projects_filter, selected_users, selected_months)
 
             if df_filtered.empty:
                 st.warning("No hay datos para los filtros seleccionados.")
@@ -148,27 +178,42 @@ def main():
             # CÁLCULOS DE KPI & BURN-DOWN
             # -------------------------------------------------------------------------
             
-            # Agrupar datos filtrados por proyecto
-            grouped_df = df_filtered.groupby('Project')['Duration (decimal)'].sum().reset_index()
-            grouped_df.rename(columns={'Duration (decimal)': 'Horas Consumidas'}, inplace=True)
-            
-            # Unir con el presupuesto definido por el usuario (Inner join para mantener integridad)
-            merged_df = pd.merge(edited_budget_df, grouped_df, on='Project', how='left').fillna(0)
+            # Una sola agrupación por proyecto y usuario: de ella salen el total por proyecto y el reparto por usuario
+            # (las filas sin usuario ya las ha descartado el filtro de usuarios)
+            project_user_hours = df_filtered.groupby(['Project', 'User'], observed=True)['Duration (decimal)'].sum()
+
+            # Agrupar datos filtrados por proyecto (Serie indexada por proyecto)
+            project_hours = project_user_hours.groupby(level='Project', observed=True).sum()
+
+            # Nos quedamos una sola vez con los proyectos seleccionados: KPIs, gráfico y tabla usan este mismo DF
+            merged_df = edited_budget_df[edited_budget_df['Project'].isin(selected_projects_filter)].copy()
+            merged_df['Horas Contratadas'] = merged_df['Horas Contratadas'].fillna(0)
+
+            # Unir con el presupuesto definido por el usuario alineando por proyecto (sin merge)
+            merged_df['Horas Consumidas'] = project_hours.reindex(
+                merged_df['Project'].to_numpy(), fill_value=0.0
+            ).to_numpy()
             
-            # Calcular Horas Restantes y Estado
-            merged_df['Horas Restantes'] = merged_df['Horas Contratadas'] - merged_df['Horas Consumidas']
-            merged_df['% Consumido'] = (merged_df['Horas Consumidas'] / merged_df['Horas Contratadas']) * 100
+            # Calcular Horas Restantes y Estado (sobre arrays: sin alinear índices y sin dividir por 0
+            # en proyectos sin presupuesto, que quedan con 0%)
+            contratadas = merged_df['Horas Contratadas'].to_numpy(dtype=np.float32)
+            consumidas = merged_df['Horas Consumidas'].to_numpy(dtype=np.float32)
+            pct = np.divide(consumidas, contratadas, out=np.zeros_like(contratadas), where=contratadas > 0)
+            pct *= 100
+            merged_df['Horas Restantes'] = contratadas - consumidas
+            merged_df['% Consumido'] = pct
             
             # Lógica para evitar números negativos en gráficos de partes, pero mantener el dato real
-            merged_df['Estado'] = merged_df.apply(lambda x: 'Excedido' if x['Horas Restantes'] < 0 else 'En Presupuesto', axis=1)
+            merged_df['Estado'] = np.where(merged_df['Horas Restantes'] < 0, 'Excedido', 'En Presupuesto')
 
             # -------------------------------------------------------------------------
             # VISUALIZACIÓN: KPIs GLOBALES
             # -------------------------------------------------------------------------
             st.subheader("Estado General (Selección Actual)")
             
-            total_budget = merged_df[merged_df['Project'].isin(selected_projects_filter)]['Horas Contratadas'].sum()
-            total_consumed = merged_df[merged_df['Project'].isin(selected_projects_filter)]['Horas Consumidas'].sum()
+            # (float de Python: las columnas son float32 y st.progress no acepta escalares de NumPy)
+            total_budget = float(merged_df['Horas Contratadas'].sum())
+            total_consumed = float(merged_df['Horas Consumidas'].sum())
             total_remaining = total_budget - total_consumed
             
             kpi1, kpi2, kpi3 = st.columns(3)
@@ -200,38 +245,21 @@ def main():
             with col_chart1:
                 st.subheader("Comparativa: Presupuesto vs Real")
                 
-                # Gráfico de Barras Agrupadas
-                # Transformamos datos para Plotly (Melting)
-                chart_data = merged_df[merged_df['Project'].isin(selected_projects_filter)].melt(
-                    id_vars=['Project'], 
-                    value_vars=['Horas Contratadas', 'Horas Consumidas'],
-                    var_name='Tipo', 
-                    value_name='Horas'
-                )
-                
-                fig_bar = px.bar(
-                    chart_data, 
-                    x='Project', 
-                    y='Horas', 
-                    color='Tipo', 
-                    barmode='group',
-                    title="Horas Contratadas vs Consumidas por Proyecto",
-                    color_discrete_map={'Horas Contratadas': '#2E86C1', 'Horas Consumidas': '#E74C3C'},
-                    text_auto='.1f'
-                )
+                # Gráfico de Barras Agrupadas (clave = huella de proyectos y horas)
+                bar_key = hash((
+                    tuple(merged_df['Project']),
+                    merged_df['Horas Contratadas'].to_numpy().tobytes(),
+                    merged_df['Horas Consumidas'].to_numpy().tobytes()
+                ))
+                fig_bar = build_bar_chart(bar_key, merged_df)
                 st.plotly_chart(fig_bar, use_container_width=True)
 
             with col_chart2:
                 st.subheader("Desglose por Usuario")
                 # Pie chart de distribución de trabajo
-                user_dist = df_filtered.groupby('User')['Duration (decimal)'].sum().reset_index()
-                fig_pie = px.pie(
-                    user_dist, 
-                    values='Duration (decimal)', 
-                    names='User', 
-                    title="Carga de Trabajo (Horas)",
-                    hole=0.4
-                )
+                user_dist = project_user_hours.groupby(level='User', observed=True).sum().reset_index()
+                pie_key = hash((tuple(user_dist['User']), user_dist['Duration (decimal)'].to_numpy().tobytes()))
+                fig_pie = build_pie_chart(pie_key, user_dist)
                 st.plotly_chart(fig_pie, use_container_width=True)
 
             # -------------------------------------------------------------------------
@@ -239,43 +267,17 @@ def main():
             # -------------------------------------------------------------------------
             st.subheader("📋 Detalle de Control Financiero")
             
-            # Pivot table para ver Usuarios por Proyecto
-            pivot_view = df_filtered.pivot_table(
-                index='Project', 
-                columns='User', 
-                values='Duration (decimal)', 
-                aggfunc='sum', 
-                fill_value=0,
-                margins=True,
-                margins_name='Total Proyecto'
-            )
+            # Pivot table para ver Usuarios por Proyecto (reordenando la agrupación ya hecha, sin volver a recorrer los datos)
+            pivot_view = project_user_hours.unstack('User', fill_value=0)
+            pivot_view['Total Proyecto'] = pivot_view.sum(axis=1)
+            pivot_view.loc['Total Proyecto'] = pivot_view.sum(axis=0)
             
             # Unir con información de presupuesto (solo para filas de proyectos, no la fila 'Total')
             # Es un poco complejo mezclar pivot con datos estáticos, así que mostraremos dos tablas o una enriquecida.
             # Vamos a mostrar la tabla enriquecida de Merged DF con resaltado.
 
-            # Estilo condicional para la tabla
-            def highlight_over_budget(row):
-                if row['Horas Restantes'] < 0:
-                    return ['background-color: #ffcccc; color: black'] * len(row)
-                return [''] * len(row)
-
-            # Preparamos tabla final para mostrar
-            display_df = merged_df[merged_df['Project'].isin(selected_projects_filter)].copy()
-            display_df = display_df.set_index('Project')
-            
-            # Formato visual
-
-            # Estilo condicional para la tabla (sin cambios)
-            def highlight_over_budget(row):
-                # Verificamos que la columna exista y sea numérica antes de comparar
-                if 'Horas Restantes' in row and isinstance(row['Horas Restantes'], (int, float)):
-                    if row['Horas Restantes'] < 0:
-                        return ['background-color: #ffcccc; color: black'] * len(row)
-                return [''] * len(row)
-
             # Preparamos tabla final para mostrar
-            display_df = merged_df[merged_df['Project'].isin(selected_projects_filter)].copy()
+            display_df = merged_df.copy()
             
             # Limpiamos columnas que no queremos mostrar o que causan ruido
             cols_to_show = ['Project', 'Horas Contratadas', 'Horas Consumidas', 'Horas Restantes', '% Consumido', 'Estado']
@@ -293,30 +295,47 @@ def main():
                 '% Consumido': '{:.1f}%'
             }
 
-            # Formato visual
+            # Formato visual (el resaltado se calcula para toda la tabla en una sola llamada)
             st.dataframe(
                 display_df.style
-                .apply(highlight_over_budget, axis=1)
+                .apply(highlight_all, axis=None)
                 .format(format_dict), # <--- AQUÍ ESTÁ EL CAMBIO CLAVE
                 use_container_width=True
             )
 
 
-            # Exportación a Excel
+            # Exportación (cada archivo se genera solo al pedirlo, no en cada cambio de filtro).
+            # Se guardan en la sesión con la huella de la selección: los botones de descarga siguen
+            # visibles (sin regenerar nada) tras descargar, hasta que cambien filtros o presupuestos
             st.subheader("📥 Descargar Reporte")
-            
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                display_df.to_excel(writer, sheet_name='Resumen Proyectos')
-                pivot_view.to_excel(writer, sheet_name='Detalle Usuarios')
-                df_filtered.to_excel(writer, sheet_name='Data Cruda Filtrada', index=False)
-                
-            st.download_button(
-                label="Descargar Excel Procesado",
-                data=buffer.getvalue(),
-                file_name="reporte_control_costes.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+            report_key = hash((bar_key, tuple(selected_users), tuple(selected_months)))
+            exports = st.session_state.setdefault('report_exports', {})
+
+            col_e1, col_e2 = st.columns(2)
+
+            with col_e1:
+                if st.button("Preparar Reporte (Excel + CSV)"):
+                    exports['zip'] = (report_key, build_report_zip(display_df, pivot_view, df_filtered))
+                if exports.get('zip', (None,))[0] == report_key:
+                    st.download_button(
+                        label="Descargar Reporte (Excel + CSV)",
+                        data=exports['zip'][1],
+                        file_name="reporte_control_costes.zip",
+                        mime="application/zip"
+                    )
+
+            # Parquet solo si pyarrow está instalado (es opcional, igual que en la carga)
+            if HAS_PYARROW:
+                with col_e2:
+                    if st.button("Preparar Datos Filtrados (Parquet)"):
+                        exports['parquet'] = (report_key, build_raw_parquet(df_filtered))
+                    if exports.get('parquet', (None,))[0] == report_key:
+                        st.download_button(
+                            label="Descargar Datos Filtrados (Parquet)",
+                            data=exports['parquet'][1],
+                            file_name="data_cruda_filtrada.parquet",
+                            mime="application/octet-stream"
+                        )
 
         else:
             st.info("Esperando carga de archivo válido...")
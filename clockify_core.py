@@ -0,0 +1,200 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import os
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+# Motores de lectura rápidos (opcionales). Si no están instalados se usa el lector clásico de pandas.
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+CSV_ENGINE = "pyarrow" if HAS_PYARROW else None
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+# -----------------------------------------------------------------------------
+# FUNCIONES COMPARTIDAS ENTRE PÁGINAS
+# Un único módulo = una única entrada de caché por cálculo, la use la página que la use.
+# -----------------------------------------------------------------------------
+
+# Un archivo subido se identifica por su file_id (único por subida): así la clave de caché no
+# obliga a Streamlit a recorrer todo el contenido del archivo en cada rerun
+@st.cache_data(hash_funcs={UploadedFile: lambda f: f.file_id})
+def load_data(file_path_or_buffer):
+    """Lee y procesa el archivo. Devuelve (df, opciones de filtro); al estar cacheado, los reruns no repiten nada."""
+    try:
+        # Detectar si es ruta local o archivo subido
+        if isinstance(file_path_or_buffer, str):
+            file_source = file_path_or_buffer
+            filename = file_path_or_buffer
+        else:
+            file_source = file_path_or_buffer
+            filename = file_path_or_buffer.name
+
+        # Copia parquet del CSV local: guarda los datos en bruto (ya parseados) y se lee mucho más rápido.
+        # Es solo una caché de lectura: el procesado se repite siempre, así un cambio en process_data
+        # nunca sirve resultados guardados con la versión anterior
+        parquet_path = None
+        df = None
+        if isinstance(file_path_or_buffer, str) and filename.endswith('.csv') and CSV_ENGINE:
+            parquet_path = os.path.splitext(filename)[0] + '.parquet'
+            if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(filename):
+                try:
+                    df = pd.read_parquet(parquet_path, engine='pyarrow')
+                    parquet_path = None  # Ya está al día: no hace falta reescribirla
+                except Exception:
+                    df = None  # Copia dañada: se vuelve a leer el CSV y se reescribe
+
+        # Cargar según extensión
+        if df is not None:
+            pass  # Leído de la copia parquet
+        elif filename.endswith('.csv'):
+            sep = detect_separator(file_source)
+            # Las configuraciones regionales que exportan con ';' usan coma decimal ("0,72")
+            decimal = ',' if sep == ';' else '.'
+            if CSV_ENGINE:
+                try:
+                    df = pd.read_csv(file_source, sep=sep, decimal=decimal, engine=CSV_ENGINE)
+                except ValueError:
+                    # Arrow es más estricto (p. ej. filas con columnas de más): reintentamos con el lector clásico
+                    if not isinstance(file_source, str):
+                        file_source.seek(0)
+            if df is not None:
+                # El lector de Arrow es multihilo pero no admite dayfirst: la fecha se parsea después
+                if 'Start Date' in df.columns:
+                    df['Start Date'] = pd.to_datetime(df['Start Date'], dayfirst=True, cache=True)
+            else:
+                df = pd.read_csv(file_source, sep=sep, decimal=decimal, parse_dates=['Start Date'], dayfirst=True)
+        else:
+            df = pd.read_excel(file_source, engine=EXCEL_ENGINE)
+
+        if not validate_columns(df):
+            return None, None
+
+        if parquet_path:
+            try:
+                df.to_parquet(parquet_path, compression='zstd', index=False)
+            except Exception:
+                pass  # La copia es opcional (carpeta de solo lectura, tipos que Arrow no admite...): seguimos con el CSV
+
+        df = process_data(df)
+        return df, filter_options(df)
+    except Exception as e:
+        st.error(f"Error al leer datos: {e}")
+        return None, None
+
+def detect_separator(file_source):
+    """Clockify exporta con coma o punto y coma según la configuración regional: se decide mirando la cabecera"""
+    if isinstance(file_source, str):
+        with open(file_source, 'rb') as f:
+            header = f.readline()
+    else:
+        header = file_source.readline()
+        file_source.seek(0)
+    return ';' if header.count(b';') > header.count(b',') else ','
+
+def validate_columns(df):
+    """
+    Verifica que las columnas esenciales de Clockify existan.
+    Se adapta a nombres comunes ('Project', 'User', 'Duration (decimal)').
+    """
+    # Ajusta estos nombres si tu export de Clockify tiene headers diferentes
+    required_columns = ['Project', 'User', 'Duration (decimal)', 'Start Date']
+
+    missing = [col for col in required_columns if col not in df.columns]
+
+    if missing:
+        st.error(f"⚠️ El archivo no tiene las columnas requeridas: {missing}. Por favor verifica tu exportación.")
+        return False
+    return True
+
+def process_data(df):
+    if 'Project' not in df.columns:
+        return df
+
+    # Limpieza
+    df = df.dropna(subset=['Project'])
+    if 'Duration (decimal)' in df.columns:
+        # float32 basta para horas y reduce a la mitad la memoria que recorre el groupby
+        df['Duration (decimal)'] = pd.to_numeric(df['Duration (decimal)'], errors='coerce').fillna(0).astype('float32')
+
+    # Crear columna Mes (datetime64 truncado a mes: ordena y compara sin crear strings por fila)
+    if 'Start Date' in df.columns:
+        df['Month_Year'] = df['Start Date'].to_numpy().astype('datetime64[M]')
+
+    # Columnas de filtro como categorías: únicos, isin y groupby trabajan sobre códigos enteros
+    for col in ('Project', 'User', 'Month_Year'):
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    # Nombres siempre como texto (p. ej. proyectos numéricos en Excel). Se pasan a texto las
+    # categorías y se reconstruye la columna desde los códigos: 1 y '1' acaban en la misma
+    # categoría y el orden es el de texto, como con astype(str). Las filas vacías siguen vacías
+    for col in ('Project', 'User'):
+        if col in df.columns and not pd.api.types.is_string_dtype(df[col].cat.categories):
+            names = df[col].cat.categories.astype(str).to_numpy(dtype=object)
+            codes = df[col].cat.codes.to_numpy()
+            df[col] = pd.Series(np.where(codes >= 0, names[codes], None), index=df.index).astype('category')
+
+    # Resto de columnas de texto como strings de Arrow: buffers contiguos en vez de objetos Python sueltos
+    # (solo las que son texto de verdad; p. ej. las horas leídas por Arrow son objetos time y se dejan igual)
+    if CSV_ENGINE:
+        for col in df.columns:
+            if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == 'string':
+                df[col] = df[col].astype('string[pyarrow]')
+
+    return df
+
+def filter_options(df):
+    """Opciones ordenadas de los filtros, leídas de las categorías (se calculan una vez por archivo)"""
+    return {
+        'projects': list(df['Project'].cat.categories),
+        'users': list(df['User'].cat.categories),
+        'months': list(np.datetime_as_string(df['Month_Year'].cat.categories.to_numpy(), unit='M')),
+        # Filas sin valor (usuario vacío, fecha sin parsear): no están en ninguna opción, así que
+        # el filtro las descarta aunque esté todo seleccionado
+        'has_na': {col: bool(df[col].hasnans) for col in ('Project', 'User', 'Month_Year')}
+    }
+
+def format_months(df):
+    """Copia para exportar con Month_Year como texto 'YYYY-MM' (solo se formatean las categorías, no cada fila)"""
+    months = df['Month_Year'].cat.categories.to_numpy()
+    return df.assign(Month_Year=df['Month_Year'].cat.rename_categories(np.datetime_as_string(months, unit='M')))
+
+def category_mask(col, selected):
+    """Máscara booleana de una columna categórica comparando códigos enteros en lugar de valores"""
+    wanted = col.cat.categories.get_indexer(selected)
+    return np.isin(col.cat.codes.to_numpy(), wanted[wanted >= 0])
+
+def apply_filters(df, options, sel_projects, sel_users, sel_months):
+    """
+    Aplica los filtros de proyecto, usuario y mes con una sola máscara, combinada en el mismo buffer.
+    Los filtros con todo seleccionado y sin valores vacíos en su columna no descartan nada y se omiten;
+    sin ninguno activo no se copia el DataFrame.
+    """
+    mask = None
+    for col, selected, all_values in (
+        ('Project', sel_projects, options['projects']),
+        ('User', sel_users, options['users']),
+        ('Month_Year', np.array(sel_months, dtype='datetime64[M]'), options['months'])
+    ):
+        if len(selected) == len(all_values) and not options['has_na'][col]:
+            continue
+        col_mask = category_mask(df[col], selected)
+        if mask is None:
+            mask = col_mask
+        else:
+            np.logical_and(mask, col_mask, out=mask)
+    return df if mask is None else df[mask]
+
+def highlight_all(df):
+    """Pinta de rojo las filas que exceden el presupuesto (toda la tabla en una sola llamada)"""
+    mask = (df['Horas Restantes'] < 0).to_numpy()
+    styles = np.where(mask[:, None], 'background-color: #ffcccc; color: black', '')
+    return pd.DataFrame(np.broadcast_to(styles, df.shape), index=df.index, columns=df.columns)